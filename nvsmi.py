@@ -10,27 +10,152 @@ Adapted from: https://github.com/anderskm/gputil
 """
 
 import argparse
+import atexit
+import functools
 import itertools as it
 import json
 import logging
+import math
 import operator
 import os
 import shlex
 import shutil
 import subprocess
 import sys
+import threading
+import time
 from datetime import datetime
-from typing import Iterable, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import pynvml
+except ImportError:  # pragma: no cover
+    pynvml = None
 
 __version__ = "0.6.0"
 
+T = TypeVar("T")
+
 
-NVIDIA_SMI_GET_GPUS = "nvidia-smi --query-gpu=index,uuid,utilization.gpu,memory.total,memory.used,memory.free,driver_version,name,gpu_serial,display_active,display_mode,temperature.gpu,timestamp --format=csv,noheader,nounits"
+NVIDIA_SMI_GET_GPUS_FULL = "nvidia-smi --query-gpu=index,uuid,utilization.gpu,memory.total,memory.used,memory.free,driver_version,name,gpu_serial,display_active,display_mode,temperature.gpu,timestamp --format=csv,noheader,nounits"
+NVIDIA_SMI_GET_GPUS_FAST = "nvidia-smi --query-gpu=index,uuid,utilization.gpu,memory.total,memory.used,memory.free,timestamp --format=csv,noheader,nounits"
+NVIDIA_SMI_GET_GPUS = NVIDIA_SMI_GET_GPUS_FULL
 NVIDIA_SMI_GET_PROCS = "nvidia-smi --query-compute-apps=pid,process_name,gpu_uuid,gpu_name,used_memory,timestamp --format=csv,noheader,nounits"
 NVIDIA_TIME_FMT = "%Y/%m/%d %H:%M:%S.%f"
+MIB = 1024**2
+
+# The commands are constant, so tokenize them once
+_NVIDIA_SMI_GET_GPUS_FULL_ARGV = shlex.split(NVIDIA_SMI_GET_GPUS_FULL)
+_NVIDIA_SMI_GET_GPUS_FAST_ARGV = shlex.split(NVIDIA_SMI_GET_GPUS_FAST)
+_NVIDIA_SMI_GET_PROCS_ARGV = shlex.split(NVIDIA_SMI_GET_PROCS)
+
+# NVML state: `None` means "not initialized yet", `False` means "not usable".
+_NVML_AVAILABLE: Optional[bool] = None
+_NVML_HANDLES: List[Any] = []
+
+# The "fast" query only asks for the columns needed to select GPUs, which saves
+# `nvidia-smi` a number of driver calls; the remaining attributes are left unset.
+_GPU_QUERIES = {
+    "full": _NVIDIA_SMI_GET_GPUS_FULL_ARGV,
+    "fast": _NVIDIA_SMI_GET_GPUS_FAST_ARGV,
+}
+_NUM_FAST_GPU_COLUMNS = 7
+
+# When NVML is not available, setting this to a number of milliseconds keeps a single
+# `nvidia-smi -lms <refresh_interval_ms>` process running in the background and serves
+# GPU queries from its latest sample instead of forking `nvidia-smi` on every call.
+refresh_interval_ms: Optional[int] = None
+_STREAMER: Optional["_NvidiaSmiStreamer"] = None
+_STREAMER_TIMEOUT = 10
+
+# GPU UUIDs and ids only change when devices are added or removed, so the mapping
+# between them is cached and refreshed by every `get_gpus()` call.
+_CACHE_TTL = 60
+_GPU_UUID_TO_ID_CACHE: Optional[Dict[str, int]] = None
+_GPU_UUID_TO_ID_TIMESTAMP = 0.0
+
+# `nvidia-smi` spends most of its time in driver ioctls; running it on the CPUs of the
+# NUMA node the GPUs are attached to avoids cross-socket traffic. Set NVSMI_PIN_NODE to
+# a node number, or to "auto" to use the node of the GPUs. Unset disables pinning.
+NVSMI_PIN_NODE_ENV = "NVSMI_PIN_NODE"
+NVIDIA_GPUS_PROC_DIR = "/proc/driver/nvidia/gpus"
+
+
+class _Record(object):
+    __slots__ = ()
+
+    def _asdict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def to_json(self) -> str:
+        return _dumps(self._asdict()).decode("utf-8")
+
+
+def _record_asdict(obj: Any) -> Dict[str, Any]:
+    if isinstance(obj, _Record):
+        return obj._asdict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _to_json_types(obj: Any) -> Any:
+    """Convert `obj` to plain JSON types for the `json` fallback
+
+    This mirrors what `orjson` does natively, so both serializers produce the same
+    document: NaN and infinity (e.g. "[N/A]" values) become null and datetimes become
+    ISO 8601 strings.
 
+    """
+    if isinstance(obj, _Record):
+        obj = obj._asdict()
+    if isinstance(obj, dict):
+        return {key: _to_json_types(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_to_json_types(value) for value in obj]
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return obj
+
+
+def _dumps(obj: Any) -> bytes:
+    """Serialize `obj` to compact JSON, using `orjson` if it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_record_asdict)
+    return json.dumps(
+        _to_json_types(obj), separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
+
+
+class GPUState(_Record):
+    __slots__ = (
+        "uuid",
+        "gpu_util",
+        "mem_used",
+        "mem_free",
+        "mem_util",
+        "temperature",
+        "timestamp",
+    )
 
-class GPUState(object):
     def __init__(
         self,
         uuid: str,
@@ -44,19 +169,31 @@ class GPUState(object):
         self.gpu_util = gpu_util
         self.mem_used = mem_used
         self.mem_free = mem_free
+        mem_total = mem_used + mem_free
+        self.mem_util = (mem_used / mem_total) * 100 if mem_total else float("nan")
         self.temperature = temperature
         self.timestamp = timestamp
 
     def __repr__(self) -> str:
         msg = "{timestamp} | UUID: {uuid} | gpu_util: {gpu_util:5.1f}% | mem_util: {mem_util:5.1f}% | mem_free: {mem_free:7.1f}MB"
-        msg = msg.format(**self.__dict__)
+        msg = msg.format(**self._asdict())
         return msg
 
-    def to_json(self) -> str:
-        return json.dumps(self.__dict__)
 
+class GPU(_Record):
+    __slots__ = (
+        "id",
+        "uuid",
+        "mem_total",
+        "driver",
+        "name",
+        "serial",
+        "display_mode",
+        "display_active",
+        "timestamp",
+        "states",
+    )
 
-class GPU(object):
     def __init__(
         self,
         id: int,
@@ -89,11 +226,18 @@ class GPU(object):
             )
 
     def update_states(self) -> None:
-        output = subprocess.check_output(
-            shlex.split(f"{NVIDIA_SMI_GET_GPUS} -i {self.id}")
-        )
-        line = output.decode("utf-8")
-        gpu_state = _get_gpu_state(line)
+        if not refresh_interval_ms:
+            _close_streamer()
+        if _nvml_init():
+            gpu_state, _ = _nvml_query_gpu(_NVML_HANDLES[self.id])
+        elif refresh_interval_ms:
+            prefix = b"%d, " % self.id
+            lines = _get_streamer().get_lines()
+            line = next(line for line in lines if line.startswith(prefix))
+            gpu_state = _get_gpu_state(_get_gpu_values(line))
+        else:
+            argv = _NVIDIA_SMI_GET_GPUS_FULL_ARGV + ["-i", str(self.id)]
+            ((_, gpu_state, _),) = _iter_nvidia_smi_lines(argv, _parse_gpu_sample)
         self.states.append(gpu_state)
 
     def clear_states(self) -> None:
@@ -107,14 +251,20 @@ class GPU(object):
 
     def __repr__(self) -> str:
         msg = "{timestamp} | UUID: {uuid} | id: {id} | mem_total: {mem_total:7.1f}MB"
-        msg = msg.format(**self.__dict__)
+        msg = msg.format(**self._asdict())
         return msg
 
-    def to_json(self) -> str:
-        return json.dumps(self.__dict__)
 
+class GPUProcess(_Record):
+    __slots__ = (
+        "pid",
+        "process_name",
+        "gpu_id",
+        "gpu_uuid",
+        "used_memory",
+        "timestamp",
+    )
 
-class GPUProcess(object):
     def __init__(
         self,
         pid: int,
@@ -122,23 +272,123 @@ class GPUProcess(object):
         gpu_uuid: str,
         used_memory: float,
         timestamp: datetime,
+        gpu_id: Optional[int] = None,
     ):
         self.pid = pid
         self.process_name = process_name
+        self.gpu_id = gpu_id
         self.gpu_uuid = gpu_uuid
         self.used_memory = used_memory
         self.timestamp = timestamp
 
     def __repr__(self) -> str:
-        msg = "{timestamp} | pid: {pid} | gpu_uuid: {gpu_uuid} | used_memory: {used_memory:7.1f}MB"
-        msg = msg.format(**self.__dict__)
+        msg = "{timestamp} | pid: {pid} | gpu_id: {gpu_id} | gpu_uuid: {gpu_uuid} | used_memory: {used_memory:7.1f}MB"
+        msg = msg.format(**self._asdict())
         return msg
 
-    def to_json(self) -> str:
-        return json.dumps(self.__dict__)
 
+class _NvidiaSmiStreamer(object):
+    """Keep a `nvidia-smi -lms` process alive and remember its latest sample"""
+
+    def __init__(self, interval_ms: int):
+        self.interval_ms = interval_ms
+        self.proc = _spawn_nvidia_smi(
+            _NVIDIA_SMI_GET_GPUS_FULL_ARGV + ["-lms", str(interval_ms)]
+        )
+        self._lines: Optional[List[bytes]] = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _publish(self, sample: List[bytes]) -> None:
+        with self._condition:
+            self._lines = list(sample)
+            self._condition.notify_all()
+
+    def _read(self) -> None:
+        # Consume the pipe continuously so that `nvidia-smi` never blocks on a full
+        # pipe and `get_lines()` always returns the most recent sample.
+        # The rows of a sample come in increasing GPU index order, so a row whose index
+        # does not increase starts the next sample. The size of the previous sample
+        # lets a sample be published as soon as its last row arrives.
+        sample: List[bytes] = []
+        last_index = -1
+        sample_size = 0
+        for line in self.proc.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            index = _get_line_index(line)
+            if sample and index <= last_index:
+                self._publish(sample)
+                sample_size = len(sample)
+                sample = []
+            last_index = index
+            sample.append(line)
+            if len(sample) == sample_size:
+                self._publish(sample)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def get_lines(self, timeout: Optional[float] = None) -> List[bytes]:
+        """Return the latest sample, waiting up to `timeout` seconds for the first one
+
+        By default, wait for a few refresh intervals on top of the start-up time of
+        `nvidia-smi`.
 
-def to_float_or_inf(value: str) -> float:
+        """
+        if timeout is None:
+            timeout = _STREAMER_TIMEOUT + 3 * self.interval_ms / 1000
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._lines is not None or self._closed, timeout
+            ):
+                raise subprocess.TimeoutExpired(self.proc.args, timeout)
+            # Never serve the last sample of a process that is gone, it won't change
+            if self._closed:
+                raise subprocess.CalledProcessError(self.proc.wait(), self.proc.args)
+            return self._lines
+
+    def close(self) -> None:
+        if self.proc.poll() is None:
+            self.proc.terminate()
+        self.proc.wait()
+        self.proc.stdout.close()
+
+
+def _get_line_index(line: bytes) -> int:
+    try:
+        return int(line.split(b",", 1)[0])
+    except ValueError:
+        # Not a GPU row (e.g. an error message): keep it in the current sample, parsing
+        # the sample reports it
+        return sys.maxsize
+
+
+def _get_streamer() -> _NvidiaSmiStreamer:
+    global _STREAMER
+    if _STREAMER is not None and (
+        _STREAMER.interval_ms != refresh_interval_ms
+        or _STREAMER.proc.poll() is not None
+    ):
+        _STREAMER.close()
+        _STREAMER = None
+    if _STREAMER is None:
+        _STREAMER = _NvidiaSmiStreamer(refresh_interval_ms)
+    return _STREAMER
+
+
+@atexit.register
+def _close_streamer() -> None:
+    global _STREAMER
+    if _STREAMER is not None:
+        _STREAMER.close()
+        _STREAMER = None
+
+
+def to_float_or_inf(value: Union[str, bytes]) -> float:
     try:
         number = float(value)
     except ValueError:
@@ -146,53 +396,201 @@ def to_float_or_inf(value: str) -> float:
     return number
 
 
-def _get_gpu(line: str) -> GPU:
-    values = line.split(", ")
-    id = int(values[0])
-    uuid = values[1]
-    gpu_util = to_float_or_inf(values[2])
-    mem_total = to_float_or_inf(values[3])
-    mem_used = to_float_or_inf(values[4])
-    mem_free = to_float_or_inf(values[5])
-    driver = values[6]
-    gpu_name = values[7]
-    serial = values[8]
-    display_active = values[9]
-    display_mode = values[10]
-    temperature = to_float_or_inf(values[11])
-    timestamp = datetime.strptime(values[12], NVIDIA_TIME_FMT)
-    gpu = GPU(
-        id=id,
+def _nvml_init() -> bool:
+    """Initialize NVML once per process and cache the device handles"""
+    global _NVML_AVAILABLE
+    if _NVML_AVAILABLE is None:
+        _NVML_AVAILABLE = False
+        if pynvml is not None:
+            try:
+                pynvml.nvmlInit()
+            except pynvml.NVMLError as exc:
+                logging.debug("NVML is not available, using nvidia-smi: %s", exc)
+            else:
+                atexit.register(pynvml.nvmlShutdown)
+                _NVML_HANDLES[:] = [
+                    pynvml.nvmlDeviceGetHandleByIndex(index)
+                    for index in range(pynvml.nvmlDeviceGetCount())
+                ]
+                _NVML_AVAILABLE = True
+    return _NVML_AVAILABLE
+
+
+def _nvml_call(func, *args, default: Any = "[Not Supported]") -> Any:
+    """Call an NVML function returning `default` if the query is not supported"""
+    try:
+        value = func(*args)
+    except pynvml.NVMLError:
+        return default
+    # Older versions of pynvml return bytes instead of str
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return value
+
+
+def _nvml_feature(func, handle) -> str:
+    value = _nvml_call(func, handle, default=None)
+    if value is None:
+        return "[Not Supported]"
+    return "Enabled" if value == pynvml.NVML_FEATURE_ENABLED else "Disabled"
+
+
+def _nvml_query_gpu(handle, full: bool = True) -> Tuple[GPUState, float]:
+    """Return the current state of a GPU and its total memory"""
+    nan = float("nan")
+    uuid = _nvml_call(pynvml.nvmlDeviceGetUUID, handle)
+    # Utilization and memory are not supported on e.g. MIG enabled GPUs, for which
+    # `nvidia-smi` reports "[N/A]"
+    utilization = _nvml_call(pynvml.nvmlDeviceGetUtilizationRates, handle, default=None)
+    memory = _nvml_call(pynvml.nvmlDeviceGetMemoryInfo, handle, default=None)
+    gpu_util = nan if utilization is None else float(utilization.gpu)
+    if memory is None:
+        mem_total = mem_used = mem_free = nan
+    else:
+        mem_total = memory.total / MIB
+        mem_used = memory.used / MIB
+        mem_free = memory.free / MIB
+    temperature = nan
+    if full:
+        temperature = _nvml_call(
+            pynvml.nvmlDeviceGetTemperature,
+            handle,
+            pynvml.NVML_TEMPERATURE_GPU,
+            default=temperature,
+        )
+    gpu_state = GPUState(
         uuid=uuid,
+        gpu_util=gpu_util,
+        mem_used=mem_used,
+        mem_free=mem_free,
+        temperature=float(temperature),
+        timestamp=datetime.now(),
+    )
+    return gpu_state, mem_total
+
+
+def _nvml_get_gpu(
+    index: int, handle, full: bool, gpu_state: GPUState, mem_total: float
+) -> GPU:
+    gpu = GPU(
+        id=index,
+        uuid=gpu_state.uuid,
         mem_total=mem_total,
-        driver=driver,
-        gpu_name=gpu_name,
-        serial=serial,
-        display_mode=display_mode,
-        display_active=display_active,
-        timestamp=timestamp,
+        driver=None,
+        gpu_name=None,
+        serial=None,
+        display_mode=None,
+        display_active=None,
+        timestamp=gpu_state.timestamp,
     )
-    gpu._append_state(
-        GPUState(
-            uuid=uuid,
-            gpu_util=gpu_util,
-            mem_used=mem_used,
-            mem_free=mem_free,
-            temperature=temperature,
+    if full:
+        gpu.driver = _nvml_call(pynvml.nvmlSystemGetDriverVersion)
+        gpu.name = _nvml_call(pynvml.nvmlDeviceGetName, handle)
+        gpu.serial = _nvml_call(pynvml.nvmlDeviceGetSerial, handle)
+        gpu.display_mode = _nvml_feature(pynvml.nvmlDeviceGetDisplayMode, handle)
+        gpu.display_active = _nvml_feature(pynvml.nvmlDeviceGetDisplayActive, handle)
+    gpu._append_state(gpu_state)
+    return gpu
+
+
+def _nvml_get_gpu_procs(index: int, handle) -> List[GPUProcess]:
+    gpu_uuid = _nvml_call(pynvml.nvmlDeviceGetUUID, handle)
+    timestamp = datetime.now()
+    processes = []
+    infos = _nvml_call(pynvml.nvmlDeviceGetComputeRunningProcesses, handle, default=[])
+    for info in infos:
+        # `usedGpuMemory` is None when the driver can't report it (e.g. on Windows)
+        if info.usedGpuMemory is None:
+            used_memory = float("nan")
+        else:
+            used_memory = info.usedGpuMemory / MIB
+        proc = GPUProcess(
+            pid=info.pid,
+            process_name=_nvml_call(pynvml.nvmlSystemGetProcessName, info.pid),
+            gpu_id=index,
+            gpu_uuid=gpu_uuid,
+            used_memory=used_memory,
             timestamp=timestamp,
         )
+        processes.append(proc)
+    return processes
+
+
+def _to_floats(*values: bytes) -> List[float]:
+    # Converting all the columns in one go is the common case; only fall back to
+    # converting them one by one if some of them are e.g. "[N/A]"
+    try:
+        return [float(value) for value in values]
+    except ValueError:
+        return [to_float_or_inf(value) for value in values]
+
+
+def _parse_timestamp(value: bytes) -> datetime:
+    """Parse an `nvidia-smi` timestamp
+
+    This is equivalent to `datetime.strptime(value, NVIDIA_TIME_FMT)` but several
+    times faster, which matters since it is the most expensive part of parsing a line.
+
+    """
+    try:
+        date, clock = value.split(b" ")
+        year, month, day = date.split(b"/")
+        hms, _, fraction = clock.partition(b".")
+        hour, minute, second = hms.split(b":")
+        microsecond = int(fraction.ljust(6, b"0")) if fraction else 0
+        return datetime(
+            int(year),
+            int(month),
+            int(day),
+            int(hour),
+            int(minute),
+            int(second),
+            microsecond,
+        )
+    except ValueError:
+        # Let `strptime` handle anything unexpected (and raise the proper error)
+        return datetime.strptime(value.decode("utf-8"), NVIDIA_TIME_FMT)
+
+
+def _decode(value: Optional[bytes]) -> Optional[str]:
+    return None if value is None else value.decode("utf-8")
+
+
+def _get_gpu_values(line: bytes) -> List[Optional[bytes]]:
+    """Split a `--query-gpu` line into the columns of the full query"""
+    values: List[Optional[bytes]] = line.split(b", ")
+    if len(values) == _NUM_FAST_GPU_COLUMNS:
+        *usage, timestamp = values
+        values = usage + [None] * 5 + [b"nan", timestamp]
+    return values
+
+
+def _get_gpu(
+    values: List[Optional[bytes]], gpu_state: Optional[GPUState] = None
+) -> GPU:
+    if gpu_state is None:
+        gpu_state = _get_gpu_state(values)
+    gpu = GPU(
+        id=int(values[0]),
+        uuid=gpu_state.uuid,
+        mem_total=to_float_or_inf(values[3]),
+        driver=_decode(values[6]),
+        gpu_name=_decode(values[7]),
+        serial=_decode(values[8]),
+        display_mode=_decode(values[10]),
+        display_active=_decode(values[9]),
+        timestamp=gpu_state.timestamp,
     )
+    gpu._append_state(gpu_state)
     return gpu
 
 
-def _get_gpu_state(line: str) -> GPUState:
-    values = line.split(", ")
-    uuid = values[1]
-    gpu_util = to_float_or_inf(values[2])
-    mem_used = to_float_or_inf(values[4])
-    mem_free = to_float_or_inf(values[5])
-    temp_gpu = to_float_or_inf(values[11])
-    timestamp = datetime.strptime(values[12], NVIDIA_TIME_FMT)
+def _get_gpu_state(values: List[Optional[bytes]]) -> GPUState:
+    uuid = values[1].decode("utf-8")
+    gpu_util, mem_used, mem_free, temp_gpu = _to_floats(
+        values[2], values[4], values[5], values[11]
+    )
+    timestamp = _parse_timestamp(values[12])
     gpu_state = GPUState(
         uuid=uuid,
         gpu_util=gpu_util,
@@ -204,23 +602,192 @@ def _get_gpu_state(line: str) -> GPUState:
     return gpu_state
 
 
-def get_gpus() -> List[GPU]:
-    output = subprocess.check_output(shlex.split(NVIDIA_SMI_GET_GPUS))
-    lines = output.decode("utf-8").split(os.linesep)
-    gpus = [_get_gpu(line) for line in lines if line.strip()]
+def _parse_cpulist(cpulist: str) -> Set[int]:
+    """Parse a sysfs cpulist (e.g. "0-3,8-11") into a set of CPU ids"""
+    cpus: Set[int] = set()
+    for chunk in cpulist.strip().split(","):
+        if chunk:
+            first, _, last = chunk.partition("-")
+            cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _get_gpus_numa_node() -> Optional[int]:
+    """Return the NUMA node all the GPUs are attached to, if there is a single one"""
+    nodes = set()
+    for bus_id in os.listdir(NVIDIA_GPUS_PROC_DIR):
+        with open(f"/sys/bus/pci/devices/{bus_id.lower()}/numa_node") as fd:
+            nodes.add(int(fd.read()))
+    if len(nodes) == 1:
+        node = nodes.pop()
+        # -1 means that the platform doesn't report NUMA information
+        return node if node >= 0 else None
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _get_pinned_cpus(pin_node: str) -> Optional[Set[int]]:
+    """Return the CPUs `nvidia-smi` should run on for the given NVSMI_PIN_NODE value"""
+    if not pin_node or not hasattr(os, "sched_setaffinity"):
+        return None
+    try:
+        node = _get_gpus_numa_node() if pin_node == "auto" else int(pin_node)
+        if node is None:
+            return None
+        with open(f"/sys/devices/system/node/node{node}/cpulist") as fd:
+            cpus = _parse_cpulist(fd.read())
+    except (OSError, ValueError) as exc:
+        logging.warning("Ignoring %s=%s: %s", NVSMI_PIN_NODE_ENV, pin_node, exc)
+        return None
+    # Stay within the CPUs we are allowed to run on (e.g. in containers)
+    return (cpus & os.sched_getaffinity(0)) or None
+
+
+def _resolve_argv(argv: List[str]) -> List[str]:
+    """Use the cached path of `nvidia-smi` so that it isn't looked up in $PATH again"""
+    path = is_nvidia_smi_on_path()
+    return [path] + argv[1:] if path else argv
+
+
+def _pin_process(pid: int) -> None:
+    """Pin a freshly spawned `nvidia-smi` to the CPUs selected by NVSMI_PIN_NODE
+
+    This is done from the parent rather than with `preexec_fn`, which is not safe to
+    use when the calling process has threads (e.g. the `-lms` streamer's reader).
+
+    """
+    cpus = _get_pinned_cpus(os.environ.get(NVSMI_PIN_NODE_ENV, ""))
+    if cpus is not None:
+        try:
+            os.sched_setaffinity(pid, cpus)
+        except ProcessLookupError:
+            # `nvidia-smi` has already exited
+            pass
+
+
+def _spawn_nvidia_smi(argv: List[str]) -> subprocess.Popen:
+    proc = subprocess.Popen(_resolve_argv(argv), stdout=subprocess.PIPE)
+    _pin_process(proc.pid)
+    return proc
+
+
+def _iter_output_lines(
+    proc: subprocess.Popen, parse: Callable[[bytes], T]
+) -> Iterator[T]:
+    """Parse the non-empty lines of the output of `proc` as they arrive
+
+    Unlike `subprocess.check_output()` this doesn't wait for the process to exit
+    before the first lines can be parsed. Like it, a non-zero exit status raises
+    `subprocess.CalledProcessError`, either once the output has been consumed or
+    as soon as a line can't be parsed (e.g. `nvidia-smi` prints its errors to stdout).
+
+    """
+    lines = []
+    for line in proc.stdout:
+        line = line.strip()
+        if not line:
+            continue
+        lines.append(line)
+        try:
+            item = parse(line)
+        except Exception:
+            rest = proc.stdout.read().strip()
+            if rest:
+                lines.append(rest)
+            if proc.wait():
+                raise subprocess.CalledProcessError(
+                    proc.returncode, proc.args, output=b"\n".join(lines)
+                ) from None
+            raise
+        yield item
+    if proc.wait():
+        raise subprocess.CalledProcessError(
+            proc.returncode, proc.args, output=b"\n".join(lines)
+        )
+
+
+def _iter_nvidia_smi_lines(argv: List[str], parse: Callable[[bytes], T]) -> Iterator[T]:
+    """Run `nvidia-smi` and parse the non-empty lines of its output as they arrive"""
+    with _spawn_nvidia_smi(argv) as proc:
+        yield from _iter_output_lines(proc, parse)
+
+
+def _parse_gpu_sample(line: bytes) -> Tuple[int, GPUState, Callable[[], GPU]]:
+    values = _get_gpu_values(line)
+    gpu_state = _get_gpu_state(values)
+    make_gpu = functools.partial(_get_gpu, values, gpu_state)
+    return int(values[0]), gpu_state, make_gpu
+
+
+def _get_gpu_samples(fields: str) -> List[Tuple[int, GPUState, Callable[[], GPU]]]:
+    """Return the id and the current state of each GPU
+
+    Building a `GPU` needs more work than its state, so each sample also carries a
+    callable that creates the `GPU` object, which lets callers only build the GPUs
+    they are going to return.
+
+    """
+    if fields not in _GPU_QUERIES:
+        raise ValueError(f"fields must be one of {sorted(_GPU_QUERIES)}: {fields!r}")
+    samples = []
+    if not refresh_interval_ms:
+        _close_streamer()
+    if _nvml_init():
+        full = fields == "full"
+        for index, handle in enumerate(_NVML_HANDLES):
+            gpu_state, mem_total = _nvml_query_gpu(handle, full)
+            make_gpu = functools.partial(
+                _nvml_get_gpu, index, handle, full, gpu_state, mem_total
+            )
+            samples.append((index, gpu_state, make_gpu))
+    elif refresh_interval_ms:
+        samples = [_parse_gpu_sample(line) for line in _get_streamer().get_lines()]
+    else:
+        argv = _GPU_QUERIES[fields]
+        samples = list(_iter_nvidia_smi_lines(argv, _parse_gpu_sample))
+    _cache_gpu_uuid_to_id_map(
+        {gpu_state.uuid: gpu_id for gpu_id, gpu_state, _ in samples}
+    )
+    return samples
+
+
+def get_gpus(fields: str = "full") -> List[GPU]:
+    """Return all the GPUs
+
+    `fields` is either "full" or "fast". The latter only queries the attributes
+    needed to select GPUs (ids, utilization and memory) which is considerably faster.
+
+    """
+    gpus = [make_gpu() for _, _, make_gpu in _get_gpu_samples(fields)]
     return gpus
 
 
-def _get_gpu_proc(line: str) -> GPUProcess:
-    values = line.split(", ")
+def _cache_gpu_uuid_to_id_map(uuid_to_id: Dict[str, int]) -> None:
+    global _GPU_UUID_TO_ID_CACHE, _GPU_UUID_TO_ID_TIMESTAMP
+    _GPU_UUID_TO_ID_CACHE = uuid_to_id
+    _GPU_UUID_TO_ID_TIMESTAMP = time.monotonic()
+
+
+def _populate_gpu_uuid_to_id_map() -> Dict[str, int]:
+    """Return the GPU UUID to id mapping, querying the GPUs only if the cache is stale"""
+    age = time.monotonic() - _GPU_UUID_TO_ID_TIMESTAMP
+    if _GPU_UUID_TO_ID_CACHE is None or age > _CACHE_TTL:
+        get_gpus(fields="fast")
+    return _GPU_UUID_TO_ID_CACHE
+
+
+def _get_gpu_proc(line: bytes, uuid_to_id: Dict[str, int]) -> GPUProcess:
+    values = line.split(b", ")
     pid = int(values[0])
-    process_name = values[1]
-    gpu_uuid = values[2]
+    process_name = values[1].decode("utf-8")
+    gpu_uuid = values[2].decode("utf-8")
+    gpu_id = uuid_to_id.get(gpu_uuid)
     used_memory = to_float_or_inf(values[4])
-    timestamp = datetime.strptime(values[5], NVIDIA_TIME_FMT)
+    timestamp = _parse_timestamp(values[5])
     proc = GPUProcess(
         pid=pid,
         process_name=process_name,
+        gpu_id=gpu_id,
         gpu_uuid=gpu_uuid,
         used_memory=used_memory,
         timestamp=timestamp,
@@ -229,30 +796,57 @@ def _get_gpu_proc(line: str) -> GPUProcess:
 
 
 def get_gpu_processes() -> List[GPUProcess]:
-    output = subprocess.check_output(shlex.split(NVIDIA_SMI_GET_PROCS))
-    lines = output.decode("utf-8").split(os.linesep)
-    processes = [_get_gpu_proc(line) for line in lines if line.strip()]
+    if _nvml_init():
+        # NVML reports the processes per device, so the GPU id is known directly
+        return [
+            proc
+            for index, handle in enumerate(_NVML_HANDLES)
+            for proc in _nvml_get_gpu_procs(index, handle)
+        ]
+    # Start the process query before (possibly) refreshing the uuid->id map, so that
+    # the two `nvidia-smi` queries run concurrently instead of one after the other.
+    with _spawn_nvidia_smi(_NVIDIA_SMI_GET_PROCS_ARGV) as proc:
+        uuid_to_id = _populate_gpu_uuid_to_id_map()
+        parse = functools.partial(_get_gpu_proc, uuid_to_id=uuid_to_id)
+        processes = list(_iter_output_lines(proc, parse))
     return processes
 
 
 ################################################################ Pause
+def _is_state_available(
+    gpu_id: int,
+    gpu_state: GPUState,
+    gpu_util_max: float,
+    mem_util_max: float,
+    mem_free_min: float,
+    include_ids: Collection[int],
+    include_uuids: Collection[str],
+) -> bool:
+    return (
+        (gpu_state.gpu_util <= gpu_util_max)
+        and (gpu_state.mem_util <= mem_util_max)
+        and (gpu_state.mem_free >= mem_free_min)
+        and (gpu_id in include_ids)
+        and (gpu_state.uuid in include_uuids)
+    )
+
+
 def is_gpu_available(
     gpu: GPU,
     gpu_util_max: float,
     mem_util_max: float,
     mem_free_min: float,
-    include_ids: List[int],
-    include_uuids: List[str],
+    include_ids: Collection[int],
+    include_uuids: Collection[str],
 ) -> bool:
-    gpu.update_states()
-    latest_state = gpu.get_latest_state()
-    mem_util = (latest_state.mem_used / latest_state.mem_free) * 100
-    return (
-        (latest_state.gpu_util <= gpu_util_max)
-        and (mem_util <= mem_util_max)
-        and (latest_state.mem_free >= mem_free_min)
-        and (gpu.id in include_ids)
-        and (gpu.uuid in include_uuids)
+    return _is_state_available(
+        gpu.id,
+        gpu.get_latest_state(),
+        gpu_util_max,
+        mem_util_max,
+        mem_free_min,
+        include_ids,
+        include_uuids,
     )
 
 
@@ -262,20 +856,29 @@ def get_available_gpus(
     mem_free_min: float = 0,
     include_ids: List[int] = [],
     include_uuids: List[str] = [],
-):
+    fields: str = "fast",
+) -> List[GPU]:
     """Return up to `limit` available cpus"""
-    # Normalize inputs (include_ids and include_uuis need to be iterables)
-    gpus = get_gpus()
-    include_ids = include_ids or [gpu.id for gpu in gpus]
-    include_uuids = include_uuids or [gpu.uuid for gpu in gpus]
-    # filter available gpus
-    selectors = (
-        is_gpu_available(
-            gpu, gpu_util_max, mem_util_max, mem_free_min, include_ids, include_uuids
-        )
-        for gpu in gpus
+    # Normalize inputs (include_ids and include_uuis need to be sets for fast lookups)
+    samples = _get_gpu_samples(fields)
+    include_ids_set = frozenset(include_ids or [gpu_id for gpu_id, _, _ in samples])
+    include_uuids_set = frozenset(
+        include_uuids or [gpu_state.uuid for _, gpu_state, _ in samples]
     )
-    available_gpus = it.compress(gpus, selectors)
+    # filter available gpus on their state and only build the ones that pass
+    available_gpus = [
+        make_gpu()
+        for gpu_id, gpu_state, make_gpu in samples
+        if _is_state_available(
+            gpu_id,
+            gpu_state,
+            gpu_util_max,
+            mem_util_max,
+            mem_free_min,
+            include_ids_set,
+            include_uuids_set,
+        )
+    ]
     return available_gpus
 
 
@@ -370,51 +973,54 @@ def _take(n: int, iterable: Iterable):
     return it.islice(iterable, n)
 
 
+@functools.lru_cache(maxsize=1)
 def is_nvidia_smi_on_path() -> Optional[str]:
     return shutil.which("nvidia-smi")
 
 
 def _nvsmi_ls(args):
-    gpus = list(
-        get_available_gpus(
-            gpu_util_max=args.gpu_util_max,
-            mem_util_max=args.mem_util_max,
-            mem_free_min=args.mem_free_min,
-            include_ids=args.ids,
-            include_uuids=args.uuids,
-        )
+    gpus = get_available_gpus(
+        gpu_util_max=args.gpu_util_max,
+        mem_util_max=args.mem_util_max,
+        mem_free_min=args.mem_free_min,
+        include_ids=args.ids,
+        include_uuids=args.uuids,
+        # The plain text output only shows the attributes of the fast query
+        fields="full" if args.json else "fast",
     )
     gpus.sort(key=operator.attrgetter(args.sort))
-    for gpu in _take(args.limit, gpus):
-        output = gpu.to_json() if args.json else gpu
-        print(output)
+    _print_records(_take(args.limit, gpus), args.json)
 
 
 def _nvsmi_ps(args):
-    gpus = get_gpus()
-    uuid_to_id = {gpu.uuid: gpu.id for gpu in gpus}
-    processes = get_gpu_processes()
-    if args.ids or args.uuids:
-        for proc in processes:
-
-            if (
-                uuid_to_id.get(proc.gpu_uuid, None) in args.ids
-                or proc.gpu_uuid in args.uuids
-            ):
-                output = proc.to_json() if args.json else proc
-                print(output)
+    # `args.ids` and `args.uuids` are sets, so the lookups don't depend on their size
+    show_all = not (args.ids or args.uuids)
+    processes = [
+        proc
+        for proc in get_gpu_processes()
+        if show_all or proc.gpu_id in args.ids or proc.gpu_uuid in args.uuids
+    ]
+    _print_records(processes, args.json)
+
+
+def _print_records(records: Iterable[_Record], as_json: bool) -> None:
+    """Print one record per line with a single write to stdout"""
+    if as_json:
+        payload = b"".join(_dumps(record._asdict()) + b"\n" for record in records)
+        output = payload.decode("utf-8")
     else:
-        for proc in processes:
-            output = proc.to_json() if args.json else proc
-            print(output)
+        output = "".join(f"{record}\n" for record in records)
+    # Write text: stdout may have been replaced by an object without `.buffer`
+    sys.stdout.write(output)
+    sys.stdout.flush()
 
 
 def validate_ids_and_uuids(args):
-    gpus = get_gpus()
-    gpu_ids = {gpu.id for gpu in gpus}
-    gpu_uuids = {gpu.uuid for gpu in gpus}
-    invalid_ids = args.ids.difference(gpu_ids)
-    invalid_uuids = args.uuids.difference(gpu_uuids)
+    uuid_to_id = _populate_gpu_uuid_to_id_map()
+    gpu_ids = set(uuid_to_id.values())
+    gpu_uuids = set(uuid_to_id)
+    invalid_ids = set(args.ids) - gpu_ids
+    invalid_uuids = set(args.uuids) - gpu_uuids
     if invalid_ids:
         sys.exit(f"The following GPU ids are not available: {invalid_ids}")
     if invalid_uuids:
@@ -429,9 +1035,12 @@ def _main():
         parser.print_help()
         sys.exit()
     else:
-        args.ids = set(args.ids) if args.ids else set()
-        args.uuids = set(args.uuids) if args.uuids else set()
-        validate_ids_and_uuids(args)
+        args.ids = frozenset(args.ids or ())
+        args.uuids = frozenset(args.uuids or ())
+        # Without filters there is nothing to validate; skipping it leaves the uuid->id
+        # map cold, so `ps` can overlap its two `nvidia-smi` queries
+        if args.ids or args.uuids:
+            validate_ids_and_uuids(args)
         if args.mode == "ls":
             _nvsmi_ls(args)
         elif args.mode == "ps":